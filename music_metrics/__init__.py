@@ -4,3 +4,8 @@ from .harmonic_metrics import *
 from .pitch_metrics import *
 from .rythm_metrics import *
 from .utils import *
+from .all_metrics import *
+from .server import *
+from .track_metrics import *
+from .fingerprint import *
+from .chunked_metrics import *
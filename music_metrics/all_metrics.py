@@ -0,0 +1,30 @@
+from .harmonic_metrics import get_harmonic_metrics
+from .pitch_metrics import get_pitch_metrics
+from .rythm_metrics import get_rythm_metrics
+from .utils import load_representations
+
+
+def get_all_metrics(data: any):
+    """
+    Calculate pitch, rhythm and harmonic metrics for a given musical data.
+
+    The representations are loaded only once and shared between
+    :func:`get_pitch_metrics`, :func:`get_rythm_metrics` and :func:`get_harmonic_metrics`.
+
+    Parameters
+    ----------
+    data : any
+        The input data for which metrics are to be calculated.
+        The format of this data is flexible and handled by :func:`utils.load_representations`.
+
+    Returns
+    -------
+    dict
+        Dictionary with ``'pitch'``, ``'rythm'`` and ``'harmonic'`` keys, each holding
+        the dictionary of metrics returned by the corresponding function.
+    """
+    representations = load_representations(data)
+    pitch_metrics, _ = get_pitch_metrics(representations)
+    rythm_metrics, _ = get_rythm_metrics(representations)
+    harmonic_metrics, _ = get_harmonic_metrics(representations)
+    return {'pitch': pitch_metrics, 'rythm': rythm_metrics, 'harmonic': harmonic_metrics}
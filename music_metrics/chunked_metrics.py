@@ -0,0 +1,281 @@
+import os
+import tempfile
+
+import numpy as np
+from prettytable import PrettyTable
+
+from .track_metrics import MetricAccumulator, _time_steps
+from .utils import load_midi_representation
+
+# Peak memory of loading a MIDI file with pretty_midi, including the intermediate mido messages,
+# per byte of the file. About 150 bytes were measured for files of 2-byte events, the shortest
+# MIDI events, and about 120 bytes for files of notes
+_LOAD_BYTES_PER_FILE_BYTE = 176
+# pretty_midi also builds an array of the time of every tick of the file, which takes 8 bytes
+# per tick once loaded and about 24 bytes per tick while it is built
+_TICK_BYTES = 8
+_LOAD_TICK_BYTES = 32
+# Memory kept per loaded pretty_midi note (about 175 bytes measured) and peak memory per note
+# of the arrays assigning the notes to chunks (about 90 bytes measured)
+_NOTE_BYTES = 192
+_ASSIGNMENT_NOTE_BYTES = 112
+# Peak memory of processing a chunk, per note of the chunk (about 200 bytes measured) and per
+# frame and time step spanned by its notes
+_CHUNK_NOTE_BYTES = 320
+_FRAME_BYTES = 12 * 8 * 2
+_STEP_BYTES = 8 * 3
+
+
+class MemoryLimitError(MemoryError):
+    """
+    Raised when processing a piece would exceed the configured memory limit.
+    """
+
+
+def _read_variable_length(midi_bytes, position):
+    value = 0
+    while True:
+        byte = midi_bytes[position]
+        position += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, position
+
+
+def _max_tick(midi_bytes):
+    # Largest tick of a MIDI file, found by skipping over the events without decoding them into
+    # messages. Returns 0 for malformed files, which pretty_midi then fails to load
+    max_tick = 0
+    position = 0
+    try:
+        while position + 8 <= len(midi_bytes):
+            chunk_type = midi_bytes[position:position + 4]
+            chunk_end = position + 8 + int.from_bytes(midi_bytes[position + 4:position + 8], 'big')
+            position += 8
+            tick = status = 0
+            while chunk_type == b'MTrk' and position < chunk_end:
+                delta, position = _read_variable_length(midi_bytes, position)
+                tick += delta
+                if midi_bytes[position] == 0xFF:
+                    length, position = _read_variable_length(midi_bytes, position + 2)
+                    position += length
+                elif midi_bytes[position] in (0xF0, 0xF7):
+                    length, position = _read_variable_length(midi_bytes, position + 1)
+                    position += length
+                else:
+                    if midi_bytes[position] >= 0x80:
+                        status = midi_bytes[position]
+                        position += 1
+                    # Data bytes without a status byte use the running status
+                    position += 1 if 0xC0 <= status < 0xE0 else 2
+            max_tick = max(max_tick, tick)
+            position = chunk_end
+    except IndexError:
+        return 0
+    return max_tick
+
+
+def _spill_array(shape, dtype, spill_dir):
+    if 0 in shape:
+        return np.zeros(shape, dtype=dtype)
+    # Anonymous temporary file, removed by the system once the array is released
+    return np.memmap(tempfile.TemporaryFile(dir=spill_dir), dtype=dtype, mode='w+', shape=shape)
+
+
+def get_chunked_metrics(data: any, max_memory=1 << 30, chunk_seconds=60.0, fs=100, spill_dir=None):
+    """
+    Calculate note-based metrics of a very large piece with bounded memory.
+
+    This mode computes a smaller set of metrics than :func:`get_pitch_metrics`,
+    :func:`get_rythm_metrics` and :func:`get_harmonic_metrics`: the metrics of
+    :meth:`MetricAccumulator.get_metrics`, derived from notes only. Muspy metrics other
+    than their note-based counterparts, tempo, beat and time signature metrics are not computed.
+
+    Only the pretty_midi representation is loaded. The piece is processed in time chunks,
+    the partial results are combined with :class:`MetricAccumulator` objects and the
+    chromagram, the number of pitches on at each time step and the onsets are spilled to memory-mapped temporary files instead
+    of being kept in memory.
+
+    Parameters
+    ----------
+    data : any
+        The input data for which metrics are to be calculated.
+        The format of this data is flexible and handled by :func:`utils.load_midi_representation`,
+        MIDI files and MIDI bytes are loaded without building other representations.
+    max_memory : int
+        Memory limit in bytes. :class:`MemoryLimitError` is raised before loading or
+        processing a piece which would exceed it. The limit covers the memory allocated
+        by this function: loading MIDI files and MIDI bytes (including the notes kept
+        while processing them) and processing the piece, but not a piece passed already
+        loaded nor the memory-mapped arrays.
+    chunk_seconds : float
+        Duration of the time chunks, in seconds. Notes belong to the chunk in which they start.
+    fs : int
+        Sampling frequency of the chromagram, in frames per second.
+    spill_dir : str, optional
+        Directory of the memory-mapped temporary files. Defaults to the system temporary directory.
+
+    Returns
+    -------
+    tuple
+        A tuple containing two elements:
+            1. Dictionary of calculated metrics, as returned by :meth:`MetricAccumulator.get_metrics`.
+               ``chroma`` and ``onsets`` are memory-mapped arrays.
+            2. :class:`PrettyTable` object summarizing these metrics along with their descriptions.
+
+    Raises
+    ------
+    MemoryLimitError
+        If the estimated memory needed to load the piece or to process a single chunk
+        exceeds ``max_memory``.
+    """
+    midi_bytes = None
+    if isinstance(data, bytes):
+        midi_bytes, source = data, 'the MIDI bytes'
+    elif isinstance(data, str) and os.path.splitext(data)[1].lower() in ['.mid', '.midi']:
+        with open(data, 'rb') as midi_file:
+            midi_bytes, source = midi_file.read(), data
+    max_tick = 0
+    if midi_bytes is not None:
+        max_tick = _max_tick(midi_bytes)
+        estimated_memory = len(midi_bytes) * _LOAD_BYTES_PER_FILE_BYTE + max_tick * _LOAD_TICK_BYTES
+        if estimated_memory > max_memory:
+            raise MemoryLimitError(f'Loading {source} may need up to {estimated_memory} bytes, '
+                                   f'which exceeds the limit of {max_memory} bytes')
+        data = midi_bytes
+
+    loaded_here = midi_bytes is not None
+    midi_representation = load_midi_representation(data)
+    del data, midi_bytes
+    tempo_changes = midi_representation.get_tempo_changes()
+    chunk_frames = int(chunk_seconds * fs)
+
+    # Assigning the notes of every instrument to chunks, without copying the notes
+    instruments = []
+    for instrument in midi_representation.instruments:
+        if not instrument.notes:
+            continue
+        starts = np.fromiter((note.start for note in instrument.notes), dtype=float, count=len(instrument.notes))
+        ends = np.fromiter((note.end for note in instrument.notes), dtype=float, count=len(instrument.notes))
+        chunks = (starts * fs).astype(np.int64) // chunk_frames
+        order = np.argsort(chunks, kind='stable')
+        instruments.append((instrument, starts[order], ends[order], chunks[order], order))
+    n_notes = sum(len(instrument.notes) for instrument, *_ in instruments)
+    n_chunks = max((int(chunks[-1]) + 1 for *_, chunks, _ in instruments), default=0)
+
+    # Frames and time steps spanned by the pitched notes of every chunk, which bound the arrays built for it
+    chunk_notes = np.zeros(n_chunks, dtype=np.int64)
+    first_frames, last_frames = np.full(n_chunks, np.iinfo(np.int64).max), np.zeros(n_chunks, dtype=np.int64)
+    first_steps, last_steps = np.full(n_chunks, np.iinfo(np.int64).max), np.zeros(n_chunks, dtype=np.int64)
+    n_frames = n_steps = 0
+    end_time = 0.0
+    for instrument, starts, ends, chunks, _ in instruments:
+        chunk_notes += np.bincount(chunks, minlength=n_chunks)
+        end_time = max(end_time, float(ends.max()))
+        end_steps = _time_steps(tempo_changes, ends)
+        n_steps = max(n_steps, int(end_steps.max()))
+        if instrument.is_drum:
+            # Percussion notes have no frames and are not counted in the polyphony, as in MetricAccumulator
+            continue
+        end_frames = (ends * fs).astype(np.int64)
+        n_frames = max(n_frames, int(end_frames.max()))
+        np.minimum.at(first_frames, chunks, (starts * fs).astype(np.int64))
+        np.maximum.at(last_frames, chunks, end_frames)
+        np.minimum.at(first_steps, chunks, _time_steps(tempo_changes, starts))
+        np.maximum.at(last_steps, chunks, end_steps)
+
+    chunk_memory = chunk_notes * _CHUNK_NOTE_BYTES + \
+        np.maximum(last_frames - first_frames, 0) * _FRAME_BYTES + np.maximum(last_steps - first_steps, 0) * _STEP_BYTES
+    chunk_memory = int(chunk_memory.max()) if n_chunks else 0
+    # Pieces loaded here are kept in memory while processing, next to the assignment to chunks, the
+    # per-chunk arrays above and the one byte per time step compared with the polyphony rate threshold
+    loaded_memory = n_notes * _NOTE_BYTES + max_tick * _TICK_BYTES if loaded_here else 0
+    kept_memory = loaded_memory + n_notes * _ASSIGNMENT_NOTE_BYTES + n_chunks * 8 * 5 + n_steps
+    if kept_memory + chunk_memory > max_memory:
+        raise MemoryLimitError(f'Processing the piece needs about {kept_memory + chunk_memory} bytes '
+                               f'({kept_memory} for {n_notes} notes, {chunk_memory} for the largest chunk), '
+                               f'which exceeds the limit of {max_memory} bytes. Try a smaller chunk_seconds.')
+
+    chroma = _spill_array((n_frames, 12), float, spill_dir)
+    active_pitches = _spill_array((n_steps,), np.int64, spill_dir)
+    onsets = _spill_array((max(n_notes, 1),), float, spill_dir)
+    n_onsets = 0
+    pitch_counts = np.zeros(128, dtype=np.int64)
+    drum_counts = MetricAccumulator(fs=fs).drum_counts
+    previous_ends = np.zeros(128, dtype=np.int64)
+
+    for chunk in range(n_chunks):
+        note_accumulators = []
+        for instrument, _, _, chunks, order in instruments:
+            start, end = np.searchsorted(chunks, [chunk, chunk + 1])
+            notes = [instrument.notes[i] for i in order[start:end]]
+            note_accumulators.append(MetricAccumulator.from_notes(notes, is_drum=instrument.is_drum,
+                                                                  tempo_changes=tempo_changes, fs=fs))
+        chunk_accumulator = MetricAccumulator.merge_all(note_accumulators, fs=fs)
+
+        # Only the frames of the chunk's own notes are built in memory, then added to the spilled arrays
+        if chunk_accumulator.start_frames.size:
+            offset = int(chunk_accumulator.start_frames.min())
+            chunk_chroma = chunk_accumulator.get_frames(offset, chunk_accumulator.end_frame - offset)
+            chroma[offset:offset + chunk_chroma.shape[1]] += chunk_chroma.T
+            # Released before the next arrays are built, so that chunks do not add up in memory
+            del chunk_chroma
+
+            # Notes of earlier chunks start before the notes of this chunk, so their ends are enough
+            # to count a pitch once when its notes overlap across chunks
+            offset = int(chunk_accumulator.start_steps.min())
+            chunk_active = chunk_accumulator.get_active_pitches(offset, int(chunk_accumulator.end_steps.max()) - offset,
+                                                                previous_ends)
+            active_pitches[offset:offset + chunk_active.size] += chunk_active
+            del chunk_active
+            np.maximum.at(previous_ends, chunk_accumulator.pitches, chunk_accumulator.end_steps)
+
+        # Chunks are disjoint in onsets, so their sorted unique onsets can be appended
+        onsets[n_onsets:n_onsets + chunk_accumulator.onsets.size] = chunk_accumulator.onsets
+        n_onsets += chunk_accumulator.onsets.size
+        pitch_counts += chunk_accumulator.pitch_counts
+        drum_counts += chunk_accumulator.drum_counts
+
+    accumulator = MetricAccumulator(fs=fs, pitch_counts=pitch_counts, drum_counts=drum_counts,
+                                    onsets=onsets[:n_onsets], end_time=end_time, n_notes=n_notes)
+    chunked_metrics = accumulator.get_metrics(chroma=chroma.T, active_pitches=active_pitches)
+
+    # Preparing a table for metrics display
+    metrics_table = PrettyTable()
+    metrics_table.field_names = ['Metric', 'Value', 'Description']
+
+    metric_descriptions = {
+        'pitch_range': 'the difference between the maximum pitch value and the minimum pitch value',
+        'n_pitches_used': 'Number of different pitches used',
+        'n_pitch_classes_used': 'Number of different pitch classes used',
+        'major_scale': 'major_scale[0] - most probably major scale, major_scale[1] - probability of that scale',
+        'minor_scale': 'minor_scale[0] - most probably minor scale, minor_scale[1] - probability of that scale',
+        'pitch_entropy': 'Entropy of pitches (measure of randomness). The greater the entropy value, the '
+                         'greater the pitch variation',
+        'pitch_class_entropy': 'Entropy of pitch classes (measure of randomness). The greater the entropy '
+                               'value, the greater the pitch classes variation',
+        'pitch_class_histogram': 'A histogram of the proportions of each sound class to all sounds occurring '
+                                 'in the piece.',
+        'chroma': 'Chromogram - flattened for all instruments occurring in the song at a given moment in time. '
+                  'Memory-mapped array.',
+        'polyphony': 'The average number of sounds played at one time. Percussion tracks are not taken into '
+                     'account.',
+        'polyphony_rate': 'The ratio of temporal moments in which more than two sounds are played to the '
+                          'duration of the entire piece.',
+        'drum_in_pattern_rate_duple': 'The ratio of percussion notes fitting a duple rhythmic pattern to the '
+                                      'total number of percussion notes.',
+        'drum_in_pattern_rate_triple': 'The ratio of percussion notes fitting a triple rhythmic pattern to the '
+                                       'total number of percussion notes.',
+        'drum_pattern_consistency': 'The largest value of the drum_in_pattern metric.',
+        'onsets': 'An array of all unique note onsets in the song. Memory-mapped array.',
+        'n_onsets': 'Number of unique note onsets in the song.',
+        'n_notes': 'Total number of notes in the song.',
+        'end_time': 'Duration of the song.',
+    }
+
+    # Populating the table with metrics and descriptions
+    for metric, value in chunked_metrics.items():
+        description = metric_descriptions.get(metric, "")
+        metrics_table.add_row([metric, value, description])
+
+    return chunked_metrics, metrics_table
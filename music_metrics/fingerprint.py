@@ -0,0 +1,316 @@
+import hashlib
+from collections import defaultdict
+
+import numpy as np
+
+from .all_metrics import get_all_metrics
+from .utils import load_midi_representation
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+
+
+def _note_array(midi_representation, resolution, velocity=False):
+    # Notes of all tracks as (onset, pitch, duration, is_drum[, velocity]) rows, quantized and
+    # sorted, so that track order, names, programs and other metadata do not matter
+    notes = [
+        (note.start, note.pitch, note.end - note.start, instrument.is_drum) + ((note.velocity,) if velocity else ())
+        for instrument in midi_representation.instruments
+        for note in instrument.notes
+    ]
+    if not notes:
+        return np.zeros((0, 5 if velocity else 4), dtype=np.int64)
+    notes = np.array(notes, dtype=float)
+    notes[:, [0, 2]] = np.round(notes[:, [0, 2]] / resolution)
+    notes = notes.astype(np.int64)
+    return notes[np.lexsort(notes.T[::-1])]
+
+
+def content_fingerprint(midi_representation, resolution=0.01):
+    """
+    Compute a fingerprint of the note content of a musical piece.
+
+    The fingerprint depends only on the onsets, pitches and durations of the notes
+    (and on whether they are percussion notes), so copies of a piece with different
+    file names, metadata, instruments or track order have the same fingerprint.
+
+    Parameters
+    ----------
+    midi_representation : pretty_midi.PrettyMIDI
+        pretty_midi representation of a musical piece.
+    resolution : float
+        Time resolution in seconds to which onsets and durations are quantized.
+
+    Returns
+    -------
+    str
+        Hexadecimal digest of the note content.
+    """
+    notes = _note_array(midi_representation, resolution)
+    return hashlib.sha1(np.ascontiguousarray(notes).tobytes()).hexdigest()
+
+
+def evaluation_fingerprint(midi_representation):
+    """
+    Compute a fingerprint of everything the metrics of a musical piece can depend on.
+
+    Unlike :func:`content_fingerprint`, times are not quantized and the track structure
+    is kept: the fingerprint depends on the exact notes (with velocities) of every track
+    in order, on the names, programs and percussion flags of the tracks, on their control
+    changes and pitch bends, and on the tempo, time signature and key signature changes.
+    Pieces with the same evaluation fingerprint have the same metrics, so results can be
+    reused between them.
+
+    Parameters
+    ----------
+    midi_representation : pretty_midi.PrettyMIDI
+        pretty_midi representation of a musical piece.
+
+    Returns
+    -------
+    str
+        Hexadecimal digest of the piece.
+    """
+    digest = hashlib.sha1()
+    digest.update(np.array(midi_representation.get_tempo_changes(), dtype=float).tobytes())
+    digest.update(repr([
+        (midi_representation.resolution, len(midi_representation.instruments)),
+        [(change.numerator, change.denominator, change.time) for change in midi_representation.time_signature_changes],
+        [(change.key_number, change.time) for change in midi_representation.key_signature_changes],
+    ]).encode())
+    for instrument in midi_representation.instruments:
+        digest.update(repr((instrument.name, instrument.program, instrument.is_drum, len(instrument.notes),
+                            len(instrument.control_changes), len(instrument.pitch_bends))).encode())
+        digest.update(np.array([(note.start, note.end, note.pitch, note.velocity) for note in instrument.notes],
+                               dtype=float).tobytes())
+        digest.update(np.array([(change.time, change.number, change.value) for change in instrument.control_changes],
+                               dtype=float).tobytes())
+        digest.update(np.array([(bend.time, bend.pitch) for bend in instrument.pitch_bends], dtype=float).tobytes())
+    return digest.hexdigest()
+
+
+def _input_fingerprint(item, midi_representation):
+    # Files and bytes are identified by their raw content, other inputs by the loaded piece
+    if isinstance(item, bytes):
+        return hashlib.sha1(item).hexdigest()
+    if isinstance(item, str):
+        with open(item, 'rb') as file:
+            return hashlib.sha1(file.read()).hexdigest()
+    return evaluation_fingerprint(midi_representation)
+
+
+def minhash_signature(midi_representation, n=4, num_perm=128, resolution=0.05, seed=0):
+    """
+    Compute a MinHash signature over pitch and onset n-grams of a musical piece.
+
+    Pitched notes are ordered by onset and each note is encoded with its pitch and the
+    time elapsed since the previous onset. The signature estimates the Jaccard similarity
+    of the sets of ``n`` consecutive encoded notes of two pieces, see :func:`signature_similarity`.
+
+    Parameters
+    ----------
+    midi_representation : pretty_midi.PrettyMIDI
+        pretty_midi representation of a musical piece.
+    n : int
+        Length of the n-grams.
+    num_perm : int
+        Number of hash functions, i.e. length of the signature.
+    resolution : float
+        Time resolution in seconds to which inter-onset intervals are quantized.
+    seed : int
+        Seed of the hash functions. Signatures are comparable only if computed with the same seed.
+
+    Returns
+    -------
+    numpy.ndarray
+        Signature of ``num_perm`` unsigned 64-bit integers.
+    """
+    notes = _note_array(midi_representation, resolution)
+    notes = notes[notes[:, 3] == 0]
+    signature = np.full(num_perm, np.iinfo(np.uint64).max, dtype=np.uint64)
+    if len(notes) < n:
+        return signature
+
+    inter_onset = np.minimum(np.diff(notes[:, 0], prepend=notes[0, 0]), 1023)
+    tokens = (notes[:, 1] * 1024 + inter_onset).astype(np.uint64)
+
+    # Polynomial hash of every n-gram, relying on unsigned 64-bit wrap-around
+    shingles = np.zeros(len(tokens) - n + 1, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for i in range(n):
+            shingles = shingles * np.uint64(1000003) ^ tokens[i:len(tokens) - n + 1 + i]
+    # Folded to 32 bits, so that a * x + b below does not overflow
+    shingles = np.unique((shingles ^ (shingles >> np.uint64(32))) & np.uint64(0xFFFFFFFF))
+
+    generator = np.random.default_rng(seed)
+    a = generator.integers(1, 1 << 32, num_perm, dtype=np.uint64)
+    b = generator.integers(0, 1 << 32, num_perm, dtype=np.uint64)
+    for i in range(num_perm):
+        signature[i] = ((a[i] * shingles + b[i]) % _MERSENNE_PRIME).min()
+    return signature
+
+
+def signature_similarity(signature_1, signature_2):
+    """
+    Estimate the Jaccard similarity of two pieces from their MinHash signatures.
+
+    Parameters
+    ----------
+    signature_1, signature_2 : numpy.ndarray
+        Signatures computed by :func:`minhash_signature` with the same parameters.
+
+    Returns
+    -------
+    float
+        Estimated similarity between 0 and 1.
+    """
+    return float(np.mean(signature_1 == signature_2))
+
+
+class DuplicateIndex:
+    """
+    Index of musical pieces detecting exact and near duplicates.
+
+    Exact duplicates are found by content fingerprint. Near duplicates are found by
+    locality-sensitive hashing of MinHash signatures split into bands, and confirmed
+    by the estimated similarity.
+
+    Parameters
+    ----------
+    threshold : float
+        Minimal estimated similarity of near duplicates.
+    bands : int
+        Number of bands the signatures are split into. More bands find less similar candidates.
+    """
+
+    def __init__(self, threshold=0.8, bands=32):
+        self.threshold = threshold
+        self.bands = bands
+        self.fingerprints = {}
+        self.signatures = {}
+        self._key_fingerprints = {}
+        self._buckets = [defaultdict(list) for _ in range(bands)]
+
+    def _band_keys(self, signature):
+        # Pieces too short to have any n-gram have empty signatures and are never near duplicates
+        if (signature == np.iinfo(np.uint64).max).all():
+            return []
+        return [band.tobytes() for band in np.array_split(signature, self.bands)]
+
+    def query(self, fingerprint, signature):
+        """
+        Find indexed pieces duplicating a given piece.
+
+        Parameters
+        ----------
+        fingerprint : str
+            Content fingerprint of the piece.
+        signature : numpy.ndarray
+            MinHash signature of the piece.
+
+        Returns
+        -------
+        tuple
+            A tuple containing two elements:
+                1. Key of an indexed exact duplicate, or ``None``.
+                2. List of ``(key, similarity)`` pairs of indexed near duplicates,
+                   sorted by decreasing similarity.
+        """
+        exact_duplicate = self.fingerprints.get(fingerprint)
+
+        candidates = set()
+        for bucket, band_key in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(bucket.get(band_key, []))
+
+        near_duplicates = []
+        for key in candidates:
+            similarity = signature_similarity(signature, self.signatures[key])
+            if similarity >= self.threshold and self._key_fingerprints[key] != fingerprint:
+                near_duplicates.append((key, similarity))
+        near_duplicates.sort(key=lambda duplicate: duplicate[1], reverse=True)
+        return exact_duplicate, near_duplicates
+
+    def add(self, key, fingerprint, signature):
+        """
+        Add a piece to the index.
+
+        Parameters
+        ----------
+        key : hashable
+            Identifier of the piece, e.g. its file path.
+        fingerprint : str
+            Content fingerprint of the piece.
+        signature : numpy.ndarray
+            MinHash signature of the piece.
+        """
+        self.fingerprints.setdefault(fingerprint, key)
+        self.signatures[key] = signature
+        self._key_fingerprints[key] = fingerprint
+        for bucket, band_key in zip(self._buckets, self._band_keys(signature)):
+            bucket[band_key].append(key)
+
+
+def evaluate_corpus(items, metric_function=get_all_metrics, threshold=0.8, index=None, fingerprint_function=None):
+    """
+    Evaluate a corpus of musical pieces, skipping duplicated content.
+
+    Every piece is fingerprinted first. Exact duplicates (same notes, regardless of
+    metadata and track order) and near duplicates are reported. Results are reused only
+    for identical inputs: files and bytes with the same content, or other pieces with the
+    same :func:`evaluation_fingerprint`.
+
+    Parameters
+    ----------
+    items : iterable
+        Musical pieces, in any format accepted by :func:`utils.load_midi_representation`.
+        File paths are used as keys of the results, other items are keyed by position.
+    metric_function : callable
+        Function computing the metrics of a single piece from its pretty_midi representation.
+    threshold : float
+        Minimal estimated similarity of near duplicates.
+    index : DuplicateIndex, optional
+        Index to use, e.g. one already holding a training set to detect memorized pieces.
+    fingerprint_function : callable, optional
+        Function computing a hashable fingerprint of a piece from its pretty_midi representation.
+        Results are reused between pieces with the same fingerprint, so it must distinguish
+        every input for which ``metric_function`` can give different results. Defaults to the
+        identical inputs described above.
+
+    Returns
+    -------
+    tuple
+        A tuple containing two elements:
+            1. Dictionary mapping keys of the pieces to their metrics.
+            2. Dictionary with ``'exact'`` (mapping keys of duplicates to keys of the
+               first occurrence) and ``'near'`` (mapping keys to lists of
+               ``(key, similarity)`` pairs of near duplicates).
+    """
+    index = DuplicateIndex(threshold=threshold) if index is None else index
+    results = {}
+    evaluated = {}
+    duplicates = {'exact': {}, 'near': {}}
+
+    for position, item in enumerate(items):
+        key = item if isinstance(item, str) else position
+        midi_representation = load_midi_representation(item)
+        fingerprint = content_fingerprint(midi_representation)
+        signature = minhash_signature(midi_representation)
+
+        exact_duplicate, near_duplicates = index.query(fingerprint, signature)
+        if near_duplicates:
+            duplicates['near'][key] = near_duplicates
+        if exact_duplicate is not None:
+            duplicates['exact'][key] = exact_duplicate
+
+        if fingerprint_function is None:
+            result_fingerprint = _input_fingerprint(item, midi_representation)
+        else:
+            result_fingerprint = fingerprint_function(midi_representation)
+        if result_fingerprint in evaluated:
+            results[key] = results[evaluated[result_fingerprint]]
+        else:
+            results[key] = metric_function(midi_representation)
+            evaluated[result_fingerprint] = key
+
+        index.add(key, fingerprint, signature)
+
+    return results, duplicates
@@ -2,10 +2,14 @@ import muspy
 # import pypianoroll - Currently unused, can be enabled if needed
 from prettytable import PrettyTable
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import numpy as np
 from collections import defaultdict
+from multiprocessing import Pool
+import os
 
-from .utils import load_representations
+from .utils import load_midi_representation, load_representations
 
 # Dictionary mapping pitch class numbers to their names
 pitch_class = {
@@ -13,6 +17,9 @@ pitch_class = {
     6: 'F#', 7: 'G', 8: 'G#', 9: 'A', 10: 'A#', 11: 'B'
 }
 
+# Figures reused between saved plots, one per plot type and size in each process
+_figures = {}
+
 
 def plot_pitch_class_histogram(histogram):
     """
@@ -53,6 +60,170 @@ def plot_chromagram(chromagram):
     plt.show()
 
 
+def _get_figure(name, figsize, dpi):
+    key = (name, figsize, dpi)
+    figure = _figures.get(key)
+    if figure is None:
+        # Rendering with the Agg canvas directly needs neither a display nor the pyplot state
+        figure = Figure(figsize=figsize, dpi=dpi)
+        FigureCanvasAgg(figure)
+        _figures[key] = figure
+    else:
+        figure.clear()
+    return figure
+
+
+def downsample_chromagram(chromagram, width):
+    """
+    Downsample a chromagram in time to at most a given number of frames.
+
+    Consecutive frames are averaged, so that long chromagrams are not drawn with
+    more frames than there are pixels.
+
+    Parameters
+    ----------
+    chromagram : array-like
+        A 2D array representing the intensity of pitch classes over time.
+    width : int
+        Maximal number of frames of the result.
+
+    Returns
+    -------
+    numpy.ndarray
+        The downsampled chromagram, or the original one if it is not longer than ``width``.
+    """
+    chromagram = np.asarray(chromagram)
+    n_frames = chromagram.shape[1]
+    if n_frames <= width:
+        return chromagram
+    edges = np.linspace(0, n_frames, width + 1).astype(int)
+    return np.add.reduceat(chromagram, edges[:-1], axis=1) / np.diff(edges)
+
+
+def save_pitch_class_histogram(histogram, path, figsize=(6.4, 4.8), dpi=100):
+    """
+    Save a histogram of pitch class distribution to a file.
+
+    The figure is drawn without pyplot, so it works without a display, and is reused
+    by subsequent calls in the same process.
+
+    Parameters
+    ----------
+    histogram : array-like
+        An array representing the frequency of each pitch class.
+    path : str
+        Path of the output file. The format is deduced from the extension.
+    figsize : tuple
+        Size of the figure in inches.
+    dpi : int
+        Resolution of the figure in dots per inch.
+    """
+    figure = _get_figure('pitch_class_histogram', figsize, dpi)
+    axes = figure.add_subplot()
+    axes.bar(np.arange(12), histogram)
+    axes.set_xticks(np.arange(12), ['C', '', 'D', '', 'E', 'F', '', 'G', '', 'A', '', 'B'])
+    axes.set_xlabel('Note')
+    axes.set_ylabel('Proportion')
+    figure.savefig(path)
+
+
+def save_chromagram(chromagram, path, figsize=(10, 5), dpi=100):
+    """
+    Save the chromagram of a musical piece to a file.
+
+    The chromagram is downsampled to the pixel width of the figure before drawing.
+    The figure is drawn without pyplot, so it works without a display, and is reused
+    by subsequent calls in the same process.
+
+    Parameters
+    ----------
+    chromagram : array-like
+        A 2D array representing the intensity of pitch classes over time.
+    path : str
+        Path of the output file. The format is deduced from the extension.
+    figsize : tuple
+        Size of the figure in inches.
+    dpi : int
+        Resolution of the figure in dots per inch.
+    """
+    n_frames = np.shape(chromagram)[1]
+    chromagram = downsample_chromagram(chromagram, int(figsize[0] * dpi))
+
+    figure = _get_figure('chromagram', figsize, dpi)
+    axes = figure.add_subplot()
+    image = axes.imshow(chromagram, aspect='auto', origin='lower', cmap='viridis',
+                        extent=(0, n_frames, -0.5, 11.5), interpolation='nearest')
+    figure.colorbar(image, ax=axes, label='Intensity')
+    axes.set_xlabel('Time (in 1/fs seconds)')
+    axes.set_ylabel('Pitch Class (C, C#, D, ..., B)')
+    axes.set_title('Chromagram')
+    figure.savefig(path)
+
+
+def _render_piece(args):
+    data, name, output_dir, fs, file_format = args
+    # Errors are reported per piece, so that one unreadable piece does not lose the rest of the batch
+    try:
+        midi_representation = load_midi_representation(data)
+        histogram_path = os.path.join(output_dir, f'{name}_pitch_class_histogram.{file_format}')
+        chromagram_path = os.path.join(output_dir, f'{name}_chromagram.{file_format}')
+        save_pitch_class_histogram(midi_representation.get_pitch_class_histogram(), histogram_path)
+        save_chromagram(midi_representation.get_chroma(fs=fs), chromagram_path)
+    except Exception as error:
+        return {'error': f'{type(error).__name__}: {error}'}
+    return histogram_path, chromagram_path
+
+
+def render_plots(items, output_dir, names=None, processes=None, fs=100, file_format='png'):
+    """
+    Save pitch class histograms and chromagrams of many musical pieces to files.
+
+    The pieces are rendered in parallel worker processes, each reusing its figures.
+
+    Parameters
+    ----------
+    items : list
+        Musical pieces, in any format accepted by :func:`utils.load_midi_representation`.
+    output_dir : str
+        Directory the files are written to. Created if it does not exist.
+    names : list of str, optional
+        Prefixes of the output file names, one for each piece. Defaults to the positions
+        of the pieces, followed by their file names for pieces given as paths.
+    processes : int, optional
+        Number of worker processes. Defaults to the number of CPUs. With ``processes=1``
+        the pieces are rendered in the calling process.
+    fs : int
+        Sampling frequency of the chromagrams, in frames per second.
+    file_format : str
+        Format of the output files, e.g. ``'png'``, ``'svg'`` or ``'pdf'``.
+
+    Returns
+    -------
+    list
+        For each piece, a tuple of the paths of its pitch class histogram and chromagram,
+        or a dictionary with an ``'error'`` key if the piece could not be rendered.
+
+    Raises
+    ------
+    ValueError
+        If the number of names differs from the number of pieces.
+    """
+    items = list(items)
+    if names is None:
+        # Prefixed with the position, so that files with the same name in different directories do not collide
+        names = [f'{position}_{os.path.splitext(os.path.basename(item))[0]}' if isinstance(item, str) else str(position)
+                 for position, item in enumerate(items)]
+    elif len(names) != len(items):
+        raise ValueError(f'Got {len(names)} names for {len(items)} pieces')
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [(item, name, output_dir, fs, file_format) for item, name in zip(items, names)]
+
+    if processes == 1 or len(tasks) < 2:
+        return [_render_piece(task) for task in tasks]
+    with Pool(processes) as pool:
+        return pool.map(_render_piece, tasks, chunksize=max(len(tasks) // (4 * (processes or os.cpu_count())), 1))
+
+
 def compute_best_scale(muspy_representation):
     """
     Compute the most likely major and minor scales for a musical piece.
@@ -0,0 +1,428 @@
+import argparse
+import functools
+import json
+import multiprocessing
+import queue
+import threading
+import time
+import urllib.request
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pretty_midi
+
+from .all_metrics import get_all_metrics
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+
+def _to_serializable(value):
+    # Metric values are mostly numpy arrays and scalars, the rest (e.g. time signatures) is sent as text
+    if isinstance(value, dict):
+        return {key: _to_serializable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_serializable(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def _warm_up():
+    # Runs every metric once on a tiny piece, so that lazy imports and first-call
+    # initialization happen at worker start instead of during the first request
+    midi = pretty_midi.PrettyMIDI()
+    instrument = pretty_midi.Instrument(program=0)
+    for i, pitch in enumerate([60, 64, 67, 72]):
+        instrument.notes.append(pretty_midi.Note(velocity=100, pitch=pitch, start=i * 0.5, end=i * 0.5 + 1.0))
+    midi.instruments.append(instrument)
+    try:
+        get_all_metrics(midi)
+    except Exception:
+        pass
+
+
+def _evaluate(data):
+    try:
+        return True, _to_serializable(get_all_metrics(data))
+    except Exception as error:
+        return False, f'{type(error).__name__}: {error}'
+
+
+class MetricsServer:
+    """
+    Local evaluation server keeping warm worker processes with the package loaded.
+
+    Requests are queued and dispatched to the worker pool in batches. Each queued
+    item is either a file path or the bytes of a MIDI file, and the result is the
+    dictionary returned by :func:`get_all_metrics` converted to plain Python types.
+
+    Parameters
+    ----------
+    host : str
+        Address the HTTP interface is bound to. Defaults to the loopback interface.
+    port : int
+        Port of the HTTP interface.
+    n_workers : int, optional
+        Number of worker processes. Defaults to the number of CPUs.
+    batch_size : int
+        Maximum number of queued requests dispatched to the workers at once.
+    batch_timeout : float
+        Time in seconds to wait for more requests before dispatching an incomplete batch.
+    warm_up : bool
+        Whether the workers compute metrics on a tiny piece at start.
+    request_timeout : float, optional
+        Time in seconds after which :meth:`evaluate` reports a request as failed
+        instead of waiting for its result. By default, it waits until the request is done.
+
+    Notes
+    -----
+    The HTTP interface accepts:
+        - ``POST /evaluate`` with a JSON body ``{"paths": [...]}`` (or ``{"path": "..."}``),
+        - ``POST /evaluate`` with raw MIDI bytes (``Content-Type: audio/midi``),
+        - ``GET /stats`` returning throughput and latency statistics.
+
+    If a worker process dies (e.g. killed by the system when out of memory), the requests
+    being evaluated fail and new workers are started for the next requests. Requests still
+    queued or being evaluated when the server is shut down fail as well.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, n_workers=None, batch_size=8, batch_timeout=0.01,
+                 warm_up=True, request_timeout=None):
+        self.host = host
+        self.port = port
+        self.n_workers = n_workers or multiprocessing.cpu_count()
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.warm_up = warm_up
+        self.request_timeout = request_timeout
+
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._pool = None
+        self._http_server = None
+        self._dispatcher = None
+        self._running = threading.Event()
+
+        self._stats_lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self._start_time = None
+        self._n_completed = self._n_errors = self._n_batches = self._n_batched_items = 0
+
+    def start(self):
+        """
+        Start the worker pool, the batch dispatcher and the HTTP interface.
+
+        Returns
+        -------
+        MetricsServer
+            The started server, so that ``server = MetricsServer().start()`` can be used.
+        """
+        self._pool = self._create_pool()
+        self._running.set()
+        self._start_time = time.perf_counter()
+
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+
+        self._http_server = _HTTPServer((self.host, self.port), _RequestHandler)
+        self._http_server.metrics_server = self
+        self.port = self._http_server.server_address[1]
+        threading.Thread(target=self._http_server.serve_forever, daemon=True).start()
+        return self
+
+    def serve_forever(self):
+        """
+        Start the server and block until it is interrupted.
+        """
+        self.start()
+        try:
+            while self._running.is_set():
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """
+        Stop the HTTP interface and the worker processes, failing the requests not evaluated yet.
+        """
+        self._running.clear()
+        if self._http_server is not None:
+            self._http_server.shutdown()
+            self._http_server.server_close()
+            self._http_server = None
+        if self._dispatcher is not None:
+            self._dispatcher.join()
+            self._dispatcher = None
+
+        # Nothing is dispatched anymore, so queued and in-flight requests would never be resolved
+        error = RuntimeError('The server was shut down before the request was evaluated')
+        with self._stats_lock:
+            while not self._queue.empty():
+                _, future, _ = self._queue.get_nowait()
+                self._pending.add(future)
+            for future in self._pending:
+                self._n_errors += 1
+                future.set_exception(error)
+            self._pending.clear()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def submit(self, data):
+        """
+        Queue a single piece for evaluation.
+
+        Parameters
+        ----------
+        data : str or bytes
+            Path of a supported file or bytes of a MIDI file.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Future resolved with the dictionary of metrics.
+        """
+        future = Future()
+        self._queue.put((data, future, time.perf_counter()))
+        return future
+
+    def evaluate(self, items):
+        """
+        Evaluate several pieces and wait for the results.
+
+        Parameters
+        ----------
+        items : list
+            Paths of supported files or bytes of MIDI files.
+
+        Returns
+        -------
+        list
+            For each item, either the dictionary of metrics or a dictionary with an ``'error'`` key.
+        """
+        futures = [self.submit(item) for item in items]
+        deadline = time.perf_counter() + self.request_timeout if self.request_timeout is not None else None
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result(timeout=max(deadline - time.perf_counter(), 0) if deadline else None))
+            except FutureTimeoutError:
+                results.append({'error': f'The request was not evaluated within {self.request_timeout} seconds'})
+            except Exception as error:
+                results.append({'error': str(error)})
+        return results
+
+    def stats(self):
+        """
+        Return throughput and latency statistics of the server.
+
+        Returns
+        -------
+        dict
+            Number of successfully completed and of failed requests, throughput of successful
+            requests per second,
+            mean batch size and latency percentiles in milliseconds.
+        """
+        with self._stats_lock:
+            latencies = np.array(self._latencies) * 1000
+            uptime = time.perf_counter() - self._start_time if self._start_time else 0.0
+            stats = {
+                'workers': self.n_workers,
+                'uptime': uptime,
+                'completed': self._n_completed,
+                'errors': self._n_errors,
+                'queued': self._queue.qsize(),
+                'batches': self._n_batches,
+                'mean_batch_size': self._n_batched_items / self._n_batches if self._n_batches else 0.0,
+                'throughput': self._n_completed / uptime if uptime else 0.0,
+            }
+        for percentile in (50, 90, 99):
+            stats[f'latency_p{percentile}_ms'] = float(np.percentile(latencies, percentile)) if latencies.size else None
+        stats['latency_mean_ms'] = float(latencies.mean()) if latencies.size else None
+        return stats
+
+    def _dispatch(self):
+        while self._running.is_set():
+            try:
+                batch = [self._queue.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            deadline = time.perf_counter() + self.batch_timeout
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.perf_counter(), 0)))
+                except queue.Empty:
+                    break
+
+            with self._stats_lock:
+                self._n_batches += 1
+                self._n_batched_items += len(batch)
+                self._pending.update(future for _, future, _ in batch)
+            for data, future, queued_at in batch:
+                try:
+                    pool_future = self._pool.submit(_evaluate, data)
+                except BrokenProcessPool:
+                    # A worker died, the requests evaluated by the old pool fail and new workers are started
+                    self._pool.shutdown(wait=False, cancel_futures=True)
+                    self._pool = self._create_pool()
+                    pool_future = self._pool.submit(_evaluate, data)
+                pool_future.add_done_callback(functools.partial(self._resolve, future, queued_at))
+
+    def _create_pool(self):
+        return ProcessPoolExecutor(self.n_workers, initializer=_warm_up if self.warm_up else None)
+
+    def _resolve(self, future, queued_at, pool_future):
+        with self._stats_lock:
+            if future not in self._pending:
+                # Already failed by shutdown
+                return
+            self._pending.discard(future)
+            self._latencies.append(time.perf_counter() - queued_at)
+            if pool_future.cancelled():
+                ok, result = False, 'The request was cancelled'
+            elif pool_future.exception() is not None:
+                # BrokenProcessPool when a worker process died
+                error = pool_future.exception()
+                ok, result = False, f'{type(error).__name__}: {error}'
+            else:
+                ok, result = pool_future.result()
+            if ok:
+                self._n_completed += 1
+                future.set_result(result)
+            else:
+                self._n_errors += 1
+                future.set_exception(ValueError(result))
+
+
+def _request_paths(request):
+    if not isinstance(request, dict):
+        return None
+    if 'paths' in request:
+        paths = request['paths']
+    elif 'path' in request:
+        paths = [request['path']]
+    else:
+        return None
+    if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+        return None
+    return paths
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    metrics_server = None
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send_json(200, self.server.metrics_server.stats())
+        else:
+            self._send_json(404, {'error': f'Unknown endpoint: {self.path}'})
+
+    def do_POST(self):
+        if self.path != '/evaluate':
+            self._send_json(404, {'error': f'Unknown endpoint: {self.path}'})
+            return
+
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            try:
+                request = json.loads(body)
+            except ValueError as error:
+                self._send_json(400, {'error': f'Invalid JSON: {error}'})
+                return
+            paths = _request_paths(request)
+            if paths is None:
+                self._send_json(400, {'error': 'Expected a JSON object with a "paths" list of strings '
+                                               'or a "path" string'})
+                return
+            self._send_json(200, {'results': self.server.metrics_server.evaluate(paths)})
+        else:
+            # Like failed paths, failed bytes are reported in the result rather than with an error status
+            result, = self.server.metrics_server.evaluate([body])
+            self._send_json(200, result)
+
+    def _send_json(self, status, content):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def request_metrics(data, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=None):
+    """
+    Request metrics from a running :class:`MetricsServer`.
+
+    Parameters
+    ----------
+    data : str, list of str or bytes
+        Path (or list of paths) of files readable by the server, or bytes of a MIDI file.
+    host : str
+        Address of the server.
+    port : int
+        Port of the server.
+    timeout : float, optional
+        Timeout of the request in seconds.
+
+    Returns
+    -------
+    dict or list
+        Dictionary of metrics for a single piece or a list of them for a list of paths.
+        Pieces which could not be evaluated are given as dictionaries with an ``'error'`` key.
+    """
+    url = f'http://{host}:{port}/evaluate'
+    if isinstance(data, bytes):
+        request = urllib.request.Request(url, data=data, headers={'Content-Type': 'audio/midi'})
+    else:
+        paths = [data] if isinstance(data, str) else list(data)
+        request = urllib.request.Request(url, data=json.dumps({'paths': paths}).encode(),
+                                         headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        content = json.loads(response.read())
+
+    if isinstance(data, bytes):
+        return content
+    return content['results'][0] if isinstance(data, str) else content['results']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local music metrics evaluation server.')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--batch-timeout', type=float, default=0.01)
+    parser.add_argument('--request-timeout', type=float, default=None)
+    args = parser.parse_args()
+
+    server = MetricsServer(host=args.host, port=args.port, n_workers=args.workers, batch_size=args.batch_size,
+                           batch_timeout=args.batch_timeout, request_timeout=args.request_timeout)
+    print(f'Serving music metrics on http://{args.host}:{args.port}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,550 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from prettytable import PrettyTable
+
+from .pitch_metrics import pitch_class
+from .utils import load_midi_representation
+
+
+# Time steps per quarter note of the muspy representation. The polyphony and drum pattern
+# metrics are computed on these time steps, as in muspy
+_RESOLUTION = 24
+_DUPLE_PATTERN = np.zeros(_RESOLUTION, dtype=bool)
+_DUPLE_PATTERN[::_RESOLUTION // 4] = True
+_TRIPLE_PATTERN = np.zeros(_RESOLUTION, dtype=bool)
+_TRIPLE_PATTERN[::_RESOLUTION // 3] = True
+
+_MAJOR_SCALE = np.array([1, 0, 1, 0, 1, 1, 0, 1, 0, 1, 0, 1], dtype=bool)
+_MINOR_SCALE = np.array([1, 0, 1, 1, 0, 1, 0, 1, 1, 0, 1, 0], dtype=bool)
+
+# Tempo of pieces without tempo changes, as in pretty_midi
+_DEFAULT_TEMPO_CHANGES = (np.array([0.0]), np.array([120.0]))
+
+# Smaller pieces are evaluated in the calling process by default, as sending
+# the tracks to worker processes costs more than evaluating them
+_PARALLEL_MIN_NOTES = 200000
+
+
+def _best_scale(pitch_class_counts, scale):
+    # Most probable root of a scale and its pitch in scale rate, as in compute_best_scale
+    total = pitch_class_counts.sum()
+    if not total:
+        return None, np.nan
+    rates = [pitch_class_counts[np.roll(scale, root)].sum() / total for root in range(12)]
+    root = int(np.argmax(rates))
+    return pitch_class[root], float(rates[root])
+
+
+def _entropy(counts):
+    total = counts.sum()
+    if total == 0:
+        return np.nan
+    probabilities = counts[counts > 0] / total
+    return float(-np.sum(probabilities * np.log2(probabilities)))
+
+
+def _time_steps(tempo_changes, times):
+    # Times in seconds mapped to time steps exactly as muspy.from_pretty_midi does, including
+    # its simplification of the tempo changes and its rounding
+    tempo_times, tempi = list(tempo_changes[0]), list(tempo_changes[1])
+    last_tempo, last_time = tempi[0], tempo_times[0]
+    i = 1
+    while i < len(tempi):
+        if tempi[i] == last_tempo:
+            del tempo_times[i], tempi[i]
+        elif tempo_times[i] == last_time:
+            del tempo_times[i - 1], tempi[i - 1]
+        else:
+            last_tempo = tempi[i]
+            i += 1
+    tempo_times, tempi = np.array(tempo_times, dtype=float), np.array(tempi, dtype=float)
+    tempo_steps = np.concatenate([[0.0], np.round(np.cumsum(np.diff(tempo_times) * _RESOLUTION * tempi[:-1] / 60.0))])
+
+    times = np.asarray(times, dtype=float)
+    index = np.maximum(np.searchsorted(tempo_times, times, side='right') - 1, 0)
+    factors = _RESOLUTION * tempi[index] / 60.0
+    return np.round(tempo_steps[index] + (times - tempo_times[index]) * factors).astype(np.int64)
+
+
+def _pitch_intervals(pitches, start_steps, end_steps, previous_ends=None):
+    # Time steps during which each pitch is on, with overlapping notes of the same pitch merged, so that
+    # a pitch is counted once per time step as in the pianoroll used by muspy. previous_ends holds, for
+    # every pitch, the end of earlier notes which do not start after any of the given notes
+    if not pitches.size:
+        return start_steps, end_steps
+    order = np.lexsort((start_steps, pitches))
+    pitches, start_steps, end_steps = pitches[order], start_steps[order], end_steps[order]
+
+    # Running maximum of the ends within every pitch, the pitches being shifted apart
+    shift = pitches * (int(end_steps.max()) + 1)
+    covered = np.maximum.accumulate(end_steps + shift) - shift
+    first = np.ones(pitches.size, dtype=bool)
+    first[1:] = pitches[1:] != pitches[:-1]
+    previous = np.zeros_like(end_steps)
+    previous[1:] = covered[:-1]
+    previous[first] = 0
+    if previous_ends is not None:
+        previous = np.maximum(previous, previous_ends[pitches])
+
+    start_steps = np.maximum(start_steps, previous)
+    kept = end_steps > start_steps
+    return start_steps[kept], end_steps[kept]
+
+
+class MetricAccumulator:
+    """
+    Mergeable accumulator of pitch, harmonic and rhythm statistics.
+
+    An accumulator is built from the notes of a single track (or of a time window
+    of a piece) and merging accumulators gives the same statistics as building one
+    from the notes of all of them. Metrics of a whole piece can therefore be derived
+    from per-track accumulators without recomputing them.
+
+    Time-dependent statistics are kept as note boundaries (in frames for the chromagram
+    and in muspy time steps for the polyphony) together with the pitches and velocities
+    of the pitched notes, so accumulators stay small and are merged by concatenation.
+    Dense arrays are built only by :meth:`get_frames` and :meth:`get_active_pitches`.
+
+    Parameters
+    ----------
+    fs : int
+        Sampling frequency of the chromagram, in frames per second.
+    pitch_counts : numpy.ndarray, optional
+        Number of pitched notes of each of the 128 pitches.
+    drum_counts : numpy.ndarray, optional
+        Number of percussion notes starting at each of the 24 time steps of a beat.
+    onsets : numpy.ndarray, optional
+        Sorted unique note onsets, in seconds.
+    end_time : float
+        End time of the last note, in seconds.
+    n_notes : int
+        Number of notes.
+    end_step : int
+        Time step at which the last note ends, percussion notes included.
+    start_frames, end_frames, start_steps, end_steps, pitches, velocities : numpy.ndarray, optional
+        Boundary frames, boundary time steps, pitches and velocities of the pitched notes.
+
+    Notes
+    -----
+    Percussion notes are counted in ``n_notes``, ``onsets``, ``end_step`` and the drum
+    pattern statistics only, as in the polyphony and pitch class histogram of the whole piece.
+    The chromagram is built from note durations, without extending the notes held by
+    the sustain pedal, so it can differ from the ``chroma`` of :func:`get_pitch_metrics`.
+    """
+
+    def __init__(self, fs=100, pitch_counts=None, drum_counts=None, onsets=None, end_time=0.0, n_notes=0,
+                 end_step=0, start_frames=None, end_frames=None, start_steps=None, end_steps=None, pitches=None,
+                 velocities=None):
+        self.fs = fs
+        self.pitch_counts = np.zeros(128, dtype=np.int64) if pitch_counts is None else pitch_counts
+        self.drum_counts = np.zeros(_RESOLUTION, dtype=np.int64) if drum_counts is None else drum_counts
+        self.onsets = np.zeros(0) if onsets is None else onsets
+        self.end_time = end_time
+        self.n_notes = n_notes
+        self.end_step = end_step
+        self.start_frames = np.zeros(0, dtype=np.int64) if start_frames is None else start_frames
+        self.end_frames = np.zeros(0, dtype=np.int64) if end_frames is None else end_frames
+        self.start_steps = np.zeros(0, dtype=np.int64) if start_steps is None else start_steps
+        self.end_steps = np.zeros(0, dtype=np.int64) if end_steps is None else end_steps
+        self.pitches = np.zeros(0, dtype=np.int64) if pitches is None else pitches
+        self.velocities = np.zeros(0, dtype=np.int64) if velocities is None else velocities
+
+    @classmethod
+    def from_arrays(cls, starts, ends, pitches, velocities, is_drum=False, tempo_changes=None, fs=100):
+        """
+        Build an accumulator from arrays of note attributes.
+
+        Parameters
+        ----------
+        starts, ends : numpy.ndarray
+            Start and end times of the notes, in seconds.
+        pitches, velocities : numpy.ndarray
+            Pitches and velocities of the notes.
+        is_drum : bool
+            Whether the notes belong to a percussion track.
+        tempo_changes : tuple, optional
+            Times and tempi of the tempo changes of the piece, as returned by
+            :meth:`pretty_midi.PrettyMIDI.get_tempo_changes`. Defaults to 120 quarter notes per minute.
+        fs : int
+            Sampling frequency of the chromagram, in frames per second.
+
+        Returns
+        -------
+        MetricAccumulator
+            Accumulator of the given notes.
+        """
+        if not len(starts):
+            return cls(fs=fs)
+
+        tempo_changes = _DEFAULT_TEMPO_CHANGES if tempo_changes is None else tempo_changes
+        start_steps = _time_steps(tempo_changes, starts)
+        end_steps = _time_steps(tempo_changes, ends)
+        accumulator = cls(fs=fs, onsets=np.unique(starts), end_time=float(np.max(ends)), n_notes=len(starts),
+                          end_step=int(end_steps.max()))
+        if is_drum:
+            accumulator.drum_counts = np.bincount(start_steps % _RESOLUTION, minlength=_RESOLUTION)
+            return accumulator
+
+        pitches = np.asarray(pitches, dtype=np.int64)
+        accumulator.pitch_counts = np.bincount(pitches, minlength=128)
+        accumulator.start_frames = (np.asarray(starts) * fs).astype(np.int64)
+        accumulator.end_frames = (np.asarray(ends) * fs).astype(np.int64)
+        accumulator.start_steps = start_steps
+        accumulator.end_steps = end_steps
+        accumulator.pitches = pitches
+        accumulator.velocities = np.asarray(velocities, dtype=np.int64)
+        return accumulator
+
+    @classmethod
+    def from_notes(cls, notes, is_drum=False, tempo_changes=None, fs=100):
+        """
+        Build an accumulator from a list of notes.
+
+        Parameters
+        ----------
+        notes : list of pretty_midi.Note
+            Notes of a track or of a time window of a piece.
+        is_drum : bool
+            Whether the notes belong to a percussion track.
+        tempo_changes : tuple, optional
+            Times and tempi of the tempo changes of the piece, see :meth:`from_arrays`.
+        fs : int
+            Sampling frequency of the chromagram, in frames per second.
+
+        Returns
+        -------
+        MetricAccumulator
+            Accumulator of the given notes.
+        """
+        starts, ends, pitches, velocities = _note_arrays(notes)
+        return cls.from_arrays(starts, ends, pitches, velocities, is_drum=is_drum, tempo_changes=tempo_changes,
+                               fs=fs)
+
+    @classmethod
+    def merge_all(cls, accumulators, fs=100):
+        """
+        Merge any number of accumulators at once.
+
+        Parameters
+        ----------
+        accumulators : list of MetricAccumulator
+            Accumulators to merge. Must use the sampling frequency ``fs``.
+        fs : int
+            Sampling frequency of the chromagram, in frames per second.
+
+        Returns
+        -------
+        MetricAccumulator
+            New accumulator holding the statistics of all of them.
+        """
+        accumulators = list(accumulators)
+        for accumulator in accumulators:
+            if accumulator.fs != fs:
+                raise ValueError(f'Cannot merge accumulators with different sampling frequencies: '
+                                 f'{fs}, {accumulator.fs}')
+        if not accumulators:
+            return cls(fs=fs)
+
+        def concatenate(attribute):
+            return np.concatenate([getattr(accumulator, attribute) for accumulator in accumulators])
+
+        return cls(
+            fs=fs,
+            pitch_counts=np.sum([accumulator.pitch_counts for accumulator in accumulators], axis=0),
+            drum_counts=np.sum([accumulator.drum_counts for accumulator in accumulators], axis=0),
+            onsets=np.unique(concatenate('onsets')),
+            end_time=max(accumulator.end_time for accumulator in accumulators),
+            n_notes=sum(accumulator.n_notes for accumulator in accumulators),
+            end_step=max(accumulator.end_step for accumulator in accumulators),
+            start_frames=concatenate('start_frames'),
+            end_frames=concatenate('end_frames'),
+            start_steps=concatenate('start_steps'),
+            end_steps=concatenate('end_steps'),
+            pitches=concatenate('pitches'),
+            velocities=concatenate('velocities'),
+        )
+
+    def merge(self, other):
+        """
+        Merge two accumulators.
+
+        Parameters
+        ----------
+        other : MetricAccumulator
+            Accumulator to merge with. Must use the same sampling frequency.
+
+        Returns
+        -------
+        MetricAccumulator
+            New accumulator holding the statistics of both.
+        """
+        return MetricAccumulator.merge_all([self, other], fs=self.fs)
+
+    @property
+    def end_frame(self):
+        """
+        Frame at which the last pitched note ends.
+        """
+        return int(self.end_frames.max()) if self.end_frames.size else 0
+
+    def get_frames(self, offset=0, n_frames=None):
+        """
+        Build the dense chromagram of a range of frames.
+
+        Parameters
+        ----------
+        offset : int
+            First frame of the range.
+        n_frames : int, optional
+            Number of frames of the range. Defaults to the frames up to :attr:`end_frame`.
+
+        Returns
+        -------
+        numpy.ndarray
+            Velocity-weighted chromagram of shape (12, n_frames).
+        """
+        if n_frames is None:
+            n_frames = max(self.end_frame - offset, 0)
+        start_frames = np.clip(self.start_frames - offset, 0, n_frames)
+        end_frames = np.clip(self.end_frames - offset, 0, n_frames)
+
+        # Frame-wise sums are built from +/- events at note boundaries instead of a dense piano roll
+        rows = (self.pitches % 12) * (n_frames + 1)
+        chroma = np.bincount(rows + start_frames, weights=self.velocities, minlength=12 * (n_frames + 1))
+        chroma -= np.bincount(rows + end_frames, weights=self.velocities, minlength=12 * (n_frames + 1))
+        chroma = chroma.reshape(12, n_frames + 1)
+        np.cumsum(chroma, axis=1, out=chroma)
+        return chroma[:, :-1]
+
+    def get_active_pitches(self, offset=0, n_steps=None, previous_ends=None):
+        """
+        Count the pitches on at each time step of a range.
+
+        As in the pianoroll used by :func:`muspy.polyphony`, a pitch played by several
+        overlapping notes is counted once.
+
+        Parameters
+        ----------
+        offset : int
+            First time step of the range.
+        n_steps : int, optional
+            Number of time steps of the range. Defaults to the time steps up to :attr:`end_step`.
+        previous_ends : numpy.ndarray, optional
+            Time step at which each of the 128 pitches stops sounding in notes counted
+            before, e.g. in earlier chunks of a piece. These notes must not start after
+            the notes of the accumulator.
+
+        Returns
+        -------
+        numpy.ndarray
+            Number of pitched notes with different pitches sounding at each time step.
+        """
+        if n_steps is None:
+            n_steps = max(self.end_step - offset, 0)
+        start_steps, end_steps = _pitch_intervals(self.pitches, self.start_steps, self.end_steps, previous_ends)
+
+        events = np.bincount(np.clip(start_steps - offset, 0, n_steps), minlength=n_steps + 1)
+        events -= np.bincount(np.clip(end_steps - offset, 0, n_steps), minlength=n_steps + 1)
+        return np.cumsum(events[:-1])
+
+    def get_metrics(self, threshold=2, with_chroma=True, chroma=None, active_pitches=None):
+        """
+        Derive pitch, harmonic and rhythm metrics from the accumulated statistics.
+
+        Parameters
+        ----------
+        threshold : int
+            Time steps with more than ``threshold`` pitches on are counted as polyphonic
+            in ``polyphony_rate``, as in :func:`muspy.polyphony_rate`.
+        with_chroma : bool
+            Whether to build the chromagram. ``chroma`` is ``None`` otherwise.
+        chroma, active_pitches : numpy.ndarray, optional
+            Arrays of the whole piece, if already built (e.g. chunk by chunk).
+            Default to the arrays returned by :meth:`get_frames` and :meth:`get_active_pitches`.
+
+        Returns
+        -------
+        dict
+            Dictionary of metrics: pitch metrics (``pitch_range``, ``n_pitches_used``,
+            ``n_pitch_classes_used``, ``major_scale``, ``minor_scale``, ``pitch_entropy``,
+            ``pitch_class_entropy``, ``pitch_class_histogram``, ``chroma``), harmonic
+            metrics (``polyphony``, ``polyphony_rate``) and rhythm metrics
+            (``drum_in_pattern_rate_duple``, ``drum_in_pattern_rate_triple``,
+            ``drum_pattern_consistency``, ``onsets``, ``n_onsets``, ``n_notes``, ``end_time``).
+        """
+        if chroma is None and with_chroma:
+            chroma = self.get_frames()
+        if active_pitches is None:
+            active_pitches = self.get_active_pitches()
+
+        used_pitches = np.flatnonzero(self.pitch_counts)
+        pitch_class_counts = np.bincount(np.arange(128) % 12, weights=self.pitch_counts, minlength=12)
+        n_pitched_notes = self.pitch_counts.sum()
+        n_sounding_steps = np.count_nonzero(active_pitches)
+
+        n_drum_notes = self.drum_counts.sum()
+        if n_drum_notes:
+            drum_in_pattern_rate_duple = float(self.drum_counts[_DUPLE_PATTERN].sum() / n_drum_notes)
+            drum_in_pattern_rate_triple = float(self.drum_counts[_TRIPLE_PATTERN].sum() / n_drum_notes)
+        else:
+            drum_in_pattern_rate_duple = drum_in_pattern_rate_triple = np.nan
+
+        return {
+            'pitch_range': int(used_pitches.max() - used_pitches.min()) if used_pitches.size else 0,
+            'n_pitches_used': int(used_pitches.size),
+            'n_pitch_classes_used': int(np.count_nonzero(pitch_class_counts)),
+            'major_scale': _best_scale(pitch_class_counts, _MAJOR_SCALE),
+            'minor_scale': _best_scale(pitch_class_counts, _MINOR_SCALE),
+            'pitch_entropy': _entropy(self.pitch_counts),
+            'pitch_class_entropy': _entropy(pitch_class_counts),
+            'pitch_class_histogram': pitch_class_counts / n_pitched_notes if n_pitched_notes else pitch_class_counts,
+            'chroma': chroma,
+            'polyphony': float(active_pitches.sum() / n_sounding_steps) if n_sounding_steps else np.nan,
+            'polyphony_rate': float(np.count_nonzero(active_pitches > threshold) / active_pitches.size)
+            if active_pitches.size else np.nan,
+            'drum_in_pattern_rate_duple': drum_in_pattern_rate_duple,
+            'drum_in_pattern_rate_triple': drum_in_pattern_rate_triple,
+            'drum_pattern_consistency': max(drum_in_pattern_rate_duple, drum_in_pattern_rate_triple)
+            if n_drum_notes else np.nan,
+            'onsets': self.onsets,
+            'n_onsets': int(self.onsets.size),
+            'n_notes': self.n_notes,
+            'end_time': self.end_time,
+        }
+
+
+def _note_arrays(notes):
+    starts = np.fromiter((note.start for note in notes), dtype=float, count=len(notes))
+    ends = np.fromiter((note.end for note in notes), dtype=float, count=len(notes))
+    pitches = np.fromiter((note.pitch for note in notes), dtype=np.int64, count=len(notes))
+    velocities = np.fromiter((note.velocity for note in notes), dtype=np.int64, count=len(notes))
+    return starts, ends, pitches, velocities
+
+
+def _track_metrics(args):
+    # Evaluated by the workers: the accumulator of a track, kept for merging, and its metrics
+    starts, ends, pitches, velocities, is_drum, tempo_changes, fs, with_chroma = args
+    accumulator = MetricAccumulator.from_arrays(starts, ends, pitches, velocities, is_drum=is_drum,
+                                                tempo_changes=tempo_changes, fs=fs)
+    return accumulator, accumulator.get_metrics(with_chroma=with_chroma)
+
+
+def _accumulator_metrics(args):
+    accumulator, with_chroma = args
+    return accumulator.get_metrics(with_chroma=with_chroma)
+
+
+def _evaluate_tracks(instruments, tasks, fs, track_chroma, executor=None):
+    map_function = map if executor is None else executor.map
+    results = list(map_function(_track_metrics, tasks))
+
+    tracks = []
+    program_accumulators = {}
+    for index, (instrument, (accumulator, metrics)) in enumerate(zip(instruments, results)):
+        tracks.append({
+            'index': index,
+            'name': instrument.name,
+            'program': instrument.program,
+            'is_drum': instrument.is_drum,
+            **metrics,
+        })
+        program = 'drums' if instrument.is_drum else instrument.program
+        program_accumulators.setdefault(program, []).append(accumulator)
+
+    # Executor.map submits all programs at once, so they are evaluated while the piece is evaluated here
+    programs = list(program_accumulators)
+    program_metrics = map_function(_accumulator_metrics, [
+        (MetricAccumulator.merge_all(program_accumulators[program], fs=fs), track_chroma) for program in programs
+    ])
+    piece_metrics = MetricAccumulator.merge_all([accumulator for accumulator, _ in results], fs=fs).get_metrics()
+
+    return {
+        'tracks': tracks,
+        'programs': dict(zip(programs, program_metrics)),
+        'piece': piece_metrics,
+    }
+
+
+def get_track_metrics(data: any, fs=100, max_workers=None, executor=None, track_chroma=False):
+    """
+    Calculate pitch, harmonic and rhythm metrics per track and per instrument.
+
+    The piece is split into tracks once, the tracks are evaluated concurrently and
+    the per-instrument and whole-piece metrics are derived by merging the per-track
+    :class:`MetricAccumulator` objects.
+
+    Parameters
+    ----------
+    data : any
+        The input data for which metrics are to be calculated.
+        The format of this data is flexible and handled by :func:`utils.load_midi_representation`.
+    fs : int
+        Sampling frequency of the chromagram, in frames per second.
+    max_workers : int, optional
+        Number of worker processes. With ``max_workers=1`` the tracks are evaluated
+        in the calling process. By default, a process pool is used only for pieces with
+        many notes, as sending the tracks to the workers costs more than evaluating small pieces.
+    executor : concurrent.futures.Executor, optional
+        Executor used instead of creating a new process pool, e.g. to reuse the same
+        worker processes for many pieces.
+    track_chroma : bool
+        Whether to build the chromagram of every track and instrument. Only the chromagram
+        of the whole piece is built by default, as one chromagram per track takes a lot of
+        memory for long pieces with many tracks.
+
+    Returns
+    -------
+    tuple
+        A tuple containing two elements:
+            1. Dictionary with ``'tracks'`` (list of per-track metrics), ``'programs'``
+               (metrics per MIDI program, percussion under the ``'drums'`` key) and
+               ``'piece'`` (metrics of the whole piece).
+            2. :class:`PrettyTable` object summarizing the per-track metrics.
+
+    Notes
+    -----
+    Only metrics that can be derived from notes are broken down: the pitch metrics of
+    :func:`get_pitch_metrics`, polyphony and polyphony rate, the drum pattern rates and
+    note onsets, counts and end times. Tempo, beat and time signature metrics describe
+    the whole piece and are not part of the breakdown.
+
+    Polyphony, polyphony rate and the drum pattern rates are computed on the time steps of
+    the muspy representation, so the values of the whole piece are the ones of
+    :func:`get_harmonic_metrics` and :func:`get_rythm_metrics`. Percussion tracks are not
+    taken into account in pitch and harmonic metrics. The chromagram ignores the sustain
+    pedal, see :class:`MetricAccumulator`.
+    """
+    midi_representation = load_midi_representation(data)
+    instruments = midi_representation.instruments
+    tempo_changes = midi_representation.get_tempo_changes()
+    tasks = [(*_note_arrays(instrument.notes), instrument.is_drum, tempo_changes, fs, track_chroma)
+             for instrument in instruments]
+    n_notes = sum(len(instrument.notes) for instrument in instruments)
+
+    if executor is not None:
+        track_metrics = _evaluate_tracks(instruments, tasks, fs, track_chroma, executor)
+    elif max_workers == 1 or len(tasks) < 2 or (max_workers is None and n_notes < _PARALLEL_MIN_NOTES):
+        track_metrics = _evaluate_tracks(instruments, tasks, fs, track_chroma)
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            track_metrics = _evaluate_tracks(instruments, tasks, fs, track_chroma, pool)
+    tracks = track_metrics['tracks']
+
+    # Preparing a table for per-track metrics display
+    metrics_table = PrettyTable()
+    metrics_table.field_names = ['Track', 'Name', 'Program', 'Notes', 'Pitch range', 'Pitch class entropy',
+                                 'Polyphony', 'Polyphony rate']
+    for track in tracks:
+        metrics_table.add_row([
+            track['index'],
+            track['name'],
+            'drums' if track['is_drum'] else track['program'],
+            track['n_notes'],
+            track['pitch_range'],
+            track['pitch_class_entropy'],
+            track['polyphony'],
+            track['polyphony_rate'],
+        ])
+
+    return track_metrics, metrics_table
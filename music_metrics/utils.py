@@ -3,6 +3,7 @@ import pretty_midi
 import muspy
 import music21
 from functools import singledispatch
+import io
 import os
 
 
@@ -19,7 +20,9 @@ def load_representations(data):
     ----------
     data : various types
         The input musical data which can be in various formats such as file paths,
-        pretty_midi.PrettyMIDI objects, music21.stream objects, etc.
+        pretty_midi.PrettyMIDI objects, music21.stream objects, raw MIDI file bytes, etc.
+        A tuple returned by a previous call is passed through unchanged, so that
+        the representations can be loaded once and shared between metric functions.
 
     Returns
     -------
@@ -56,6 +59,20 @@ def _(data: str):
         raise ValueError(f'Unsupported file type: {extension}')
 
 
+@load_representations.register
+def _(data: bytes):
+    midi_representation = pretty_midi.PrettyMIDI(io.BytesIO(data))
+    muspy_representation = muspy.from_pretty_midi(midi_representation)
+    pianoroll_representation = midi_representation.get_piano_roll()
+    return muspy_representation, midi_representation, pianoroll_representation
+
+
+@load_representations.register
+def _(data: tuple):
+    # Representations already loaded, e.g. shared between several metric functions
+    return data
+
+
 @load_representations.register
 def _(data: pypianoroll.Multitrack):
     muspy_representation = muspy.inputs.from_pypianoroll(data)
@@ -107,3 +124,30 @@ def _(data: music21.stream.Score):
     midi_representation = muspy.outputs.to_pretty_midi(muspy_representation)
     pianoroll_representation = muspy.outputs.to_pypianoroll(muspy_representation)
     return muspy_representation, midi_representation, pianoroll_representation
+
+
+def load_midi_representation(data):
+    """
+    Load musical data into a pretty_midi representation only.
+
+    MIDI files, MIDI bytes and :class:`pretty_midi.PrettyMIDI` objects are handled
+    without building the muspy and pypianoroll representations. Other inputs are
+    converted with :func:`load_representations`.
+
+    Parameters
+    ----------
+    data : various types
+        The input musical data, in any format accepted by :func:`load_representations`.
+
+    Returns
+    -------
+    pretty_midi.PrettyMIDI
+        pretty_midi representation of the data.
+    """
+    if isinstance(data, pretty_midi.PrettyMIDI):
+        return data
+    if isinstance(data, bytes):
+        return pretty_midi.PrettyMIDI(io.BytesIO(data))
+    if isinstance(data, str) and os.path.splitext(data)[1].lower() in ['.mid', '.midi']:
+        return pretty_midi.PrettyMIDI(data)
+    return load_representations(data)[1]
@@ -2,11 +2,27 @@ import pytest
 from music_metrics import get_pitch_metrics
 from music_metrics import get_rythm_metrics
 from music_metrics import get_harmonic_metrics
+from music_metrics import get_all_metrics
+from music_metrics import MetricsServer, request_metrics
+from music_metrics import get_track_metrics
+from music_metrics import content_fingerprint, evaluate_corpus
+from music_metrics import downsample_chromagram, render_plots
+from music_metrics import get_chunked_metrics, MemoryLimitError
 
 import pretty_midi
+import copy
 import pypianoroll
+import numpy as np
 
+import io
+import multiprocessing
 import os
+import signal
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 
@@ -139,3 +155,275 @@ def test_pitch_metrics_table_midi_path(midi_file_path, table_field_names):
     assert metrics_pitch_table_path.field_names == table_field_names
     assert metrics_rythm_table_path.field_names == table_field_names
     assert metrics_harmonic_table_path.field_names == table_field_names
+
+
+def test_all_metrics_midi_bytes(midi_file_path, pitch_metric_names, rythm_metric_names, harmonic_metric_names):
+    with open(midi_file_path, 'rb') as midi_file:
+        all_metrics = get_all_metrics(midi_file.read())
+
+    assert list(all_metrics['pitch'].keys()) == pitch_metric_names
+    assert list(all_metrics['rythm'].keys()) == rythm_metric_names
+    assert list(all_metrics['harmonic'].keys()) == harmonic_metric_names
+
+
+def test_metrics_server(midi_file_path, pitch_metric_names):
+    with MetricsServer(port=0, n_workers=1, warm_up=False) as server:
+        path_metrics = request_metrics(midi_file_path, port=server.port)
+        with open(midi_file_path, 'rb') as midi_file:
+            bytes_metrics = request_metrics(midi_file.read(), port=server.port)
+        stats = server.stats()
+
+    assert list(path_metrics['pitch'].keys()) == pitch_metric_names
+    assert path_metrics['pitch']['pitch_range'] == bytes_metrics['pitch']['pitch_range']
+    assert stats['completed'] == 2
+    assert stats['errors'] == 0
+
+
+def test_metrics_server_errors(test_dir):
+    missing_path = str(test_dir / 'missing.mid')
+    with MetricsServer(port=0, n_workers=1, warm_up=False) as server:
+        path_result = request_metrics(missing_path, port=server.port)
+        bytes_result = request_metrics(b'not a midi file', port=server.port)
+        for body in (b'[1, 2]', b'{"other": 1}', b'{"paths": "a.mid"}'):
+            request = urllib.request.Request(f'http://127.0.0.1:{server.port}/evaluate', data=body,
+                                             headers={'Content-Type': 'application/json'})
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(request)
+            assert error.value.code == 400
+        stats = server.stats()
+
+    assert 'error' in path_result
+    assert 'error' in bytes_result
+    assert stats['completed'] == 0
+    assert stats['errors'] == 2
+
+
+def test_metrics_server_worker_failures(midi_file_path):
+    # A piece slow enough to be still evaluated when its worker is killed
+    midi = pretty_midi.PrettyMIDI()
+    instrument = pretty_midi.Instrument(program=0)
+    for i in range(20000):
+        instrument.notes.append(pretty_midi.Note(velocity=90, pitch=40 + i % 40, start=i * 0.05, end=i * 0.05 + 0.5))
+    midi.instruments.append(instrument)
+    midi_bytes = io.BytesIO()
+    midi.write(midi_bytes)
+
+    with MetricsServer(port=0, n_workers=1, warm_up=False) as server:
+        killed = server.submit(midi_bytes.getvalue())
+        while not multiprocessing.active_children():
+            time.sleep(0.01)
+        for process in multiprocessing.active_children():
+            os.kill(process.pid, signal.SIGKILL)
+        killed_error = killed.exception(timeout=10)
+        restarted_result, = server.evaluate([midi_file_path])
+        shut_down = [server.submit(midi_file_path) for _ in range(20)]
+
+    assert killed_error is not None
+    assert 'error' not in restarted_result
+    for future in shut_down:
+        assert future.done()
+
+
+def test_track_metrics_merge(PrettyMIDI_type):
+    track_metrics, _ = get_track_metrics(PrettyMIDI_type, max_workers=1)
+    piece_metrics = track_metrics['piece']
+    pitch_metrics, _ = get_pitch_metrics(PrettyMIDI_type)
+    harmonic_metrics, _ = get_harmonic_metrics(PrettyMIDI_type)
+
+    assert len(track_metrics['tracks']) == len(PrettyMIDI_type.instruments)
+    assert piece_metrics['n_notes'] == sum(track['n_notes'] for track in track_metrics['tracks'])
+    assert np.allclose(piece_metrics['pitch_class_histogram'], PrettyMIDI_type.get_pitch_class_histogram())
+    assert piece_metrics['major_scale'] == pytest.approx(pitch_metrics['major_scale'])
+    assert piece_metrics['minor_scale'] == pytest.approx(pitch_metrics['minor_scale'])
+    assert piece_metrics['polyphony'] == pytest.approx(harmonic_metrics['polyphony'])
+    assert piece_metrics['polyphony_rate'] == pytest.approx(harmonic_metrics['polyphony_rate'])
+    assert track_metrics['tracks'][0]['chroma'] is None
+
+
+def test_track_metrics_drums(PrettyMIDI_type):
+    drums = pretty_midi.Instrument(program=0, is_drum=True)
+    for start in np.arange(0.0, 60.0, 0.3):
+        drums.notes.append(pretty_midi.Note(velocity=100, pitch=36, start=start, end=start + 0.1))
+    PrettyMIDI_type.instruments.append(drums)
+
+    track_metrics, _ = get_track_metrics(PrettyMIDI_type, max_workers=1)
+    rythm_metrics, _ = get_rythm_metrics(PrettyMIDI_type)
+
+    assert track_metrics['programs']['drums']['drum_in_pattern_rate_duple'] == \
+        pytest.approx(rythm_metrics['drum_in_pattern_rate_duple'])
+    assert track_metrics['piece']['drum_pattern_consistency'] == \
+        pytest.approx(rythm_metrics['drum_pattern_consistency'])
+    assert np.isnan(track_metrics['tracks'][0]['drum_pattern_consistency'])
+
+
+def test_track_metrics_parallel(PrettyMIDI_type):
+    serial_metrics, _ = get_track_metrics(PrettyMIDI_type, max_workers=1, track_chroma=True)
+    parallel_metrics, _ = get_track_metrics(PrettyMIDI_type, max_workers=2, track_chroma=True)
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        executor_metrics, _ = get_track_metrics(PrettyMIDI_type, executor=executor, track_chroma=True)
+
+    for metrics in (parallel_metrics, executor_metrics):
+        serial_results = serial_metrics['tracks'] + list(serial_metrics['programs'].values()) + [serial_metrics['piece']]
+        results = metrics['tracks'] + list(metrics['programs'].values()) + [metrics['piece']]
+        assert list(metrics['programs']) == list(serial_metrics['programs'])
+        for serial_result, result in zip(serial_results, results):
+            assert result.keys() == serial_result.keys()
+            for metric, value in serial_result.items():
+                if isinstance(value, (str, tuple)):
+                    assert result[metric] == value
+                else:
+                    assert np.array_equal(result[metric], value, equal_nan=True)
+
+
+def test_duplicate_detection(PrettyMIDI_type):
+    reordered = copy.deepcopy(PrettyMIDI_type)
+    reordered.instruments.reverse()
+    reordered.instruments[0].name = 'renamed'
+    modified = copy.deepcopy(PrettyMIDI_type)
+    for note in modified.instruments[0].notes[:20]:
+        note.pitch += 1
+
+    assert content_fingerprint(PrettyMIDI_type) == content_fingerprint(reordered)
+    assert content_fingerprint(PrettyMIDI_type) != content_fingerprint(modified)
+
+    results, duplicates = evaluate_corpus([PrettyMIDI_type, reordered, modified],
+                                          metric_function=lambda midi: {'end_time': midi.get_end_time()})
+    assert duplicates['exact'] == {1: 0}
+    assert [key for key, _ in duplicates['near'][2]] == [0, 1]
+    # Track order can change metrics, so results are reused only for identical inputs
+    assert results[1] is not results[0]
+    assert results[1] == results[0]
+
+
+def test_duplicate_reuse_depends_on_velocity_and_meter(PrettyMIDI_type):
+    rescaled = copy.deepcopy(PrettyMIDI_type)
+    for instrument in rescaled.instruments:
+        for note in instrument.notes:
+            note.velocity //= 3
+    rescaled.time_signature_changes = [pretty_midi.TimeSignature(3, 4, 0.0)]
+    copies = [PrettyMIDI_type, copy.deepcopy(PrettyMIDI_type), rescaled]
+
+    results, duplicates = evaluate_corpus(copies, metric_function=lambda midi: {'n_beats': len(midi.get_downbeats())})
+
+    assert duplicates['exact'] == {1: 0, 2: 0}
+    assert 2 not in duplicates['near']
+    assert results[1] is results[0]
+    assert results[2] is not results[0]
+    assert results[2]['n_beats'] == len(rescaled.get_downbeats())
+
+
+def test_duplicate_reuse_requires_identical_input():
+    midi = pretty_midi.PrettyMIDI()
+    instrument = pretty_midi.Instrument(program=0)
+    for i, pitch in enumerate([60, 62, 64, 65, 67, 69, 71, 72]):
+        instrument.notes.append(pretty_midi.Note(velocity=100, pitch=pitch, start=i * 0.5, end=i * 0.5 + 0.4))
+    midi.instruments.append(instrument)
+    # Shifted by less than the resolution of the content fingerprint
+    shifted = copy.deepcopy(midi)
+    for note in shifted.instruments[0].notes:
+        note.start += 0.003
+        note.end += 0.003
+    # Same notes, one track split in two
+    split = copy.deepcopy(midi)
+    split.instruments.append(pretty_midi.Instrument(program=0))
+    split.instruments[1].notes = split.instruments[0].notes[4:]
+    split.instruments[0].notes = split.instruments[0].notes[:4]
+
+    results, duplicates = evaluate_corpus([midi, shifted, split, copy.deepcopy(midi)],
+                                          metric_function=lambda piece: get_track_metrics(piece, max_workers=1)[0])
+
+    assert duplicates['exact'] == {1: 0, 2: 0, 3: 0}
+    assert results[3] is results[0]
+    assert results[1] is not results[0]
+    assert results[1]['piece']['onsets'][0] == pytest.approx(0.003)
+    assert len(results[2]['tracks']) == 2
+
+    results, _ = evaluate_corpus([midi, shifted], metric_function=lambda piece: piece.instruments[0].notes[0].pitch,
+                                 fingerprint_function=content_fingerprint)
+    assert results[1] == results[0]
+
+
+def test_render_plots(midi_file_path, tmp_path):
+    paths = render_plots([midi_file_path, midi_file_path], str(tmp_path), names=['first', 'second'], processes=2)
+
+    assert len(paths) == 2
+    for histogram_path, chromagram_path in paths:
+        assert os.path.getsize(histogram_path) > 0
+        assert os.path.getsize(chromagram_path) > 0
+
+
+def test_render_plots_names(midi_file_path, tmp_path):
+    paths = render_plots([midi_file_path, midi_file_path], str(tmp_path), processes=1)
+    assert len(set(paths)) == 2
+
+    with pytest.raises(ValueError):
+        render_plots([midi_file_path, midi_file_path], str(tmp_path), names=['first'], processes=1)
+
+
+def test_render_plots_errors(midi_file_path, test_dir, tmp_path):
+    paths = render_plots([midi_file_path, str(test_dir / 'missing.mid'), b'not a midi file'], str(tmp_path),
+                         processes=2)
+
+    assert os.path.getsize(paths[0][0]) > 0
+    assert 'error' in paths[1]
+    assert 'error' in paths[2]
+
+
+def test_downsample_chromagram():
+    chromagram = np.random.rand(12, 10000)
+    downsampled = downsample_chromagram(chromagram, 1000)
+
+    assert downsampled.shape == (12, 1000)
+    assert np.isclose(downsampled.mean(), chromagram.mean())
+
+
+def test_chunked_metrics(midi_file_path, PrettyMIDI_type):
+    # A percussion track ending after all pitched notes, spanning several chunks
+    end_time = PrettyMIDI_type.get_end_time()
+    drums = pretty_midi.Instrument(program=0, is_drum=True)
+    for start in np.arange(0.0, end_time + 20.0, 0.5):
+        drums.notes.append(pretty_midi.Note(velocity=100, pitch=36, start=start, end=start + 0.1))
+    PrettyMIDI_type.instruments.append(drums)
+
+    chunked_metrics, _ = get_chunked_metrics(PrettyMIDI_type, chunk_seconds=10.0)
+    track_metrics, _ = get_track_metrics(PrettyMIDI_type, max_workers=1)
+
+    for metric, value in track_metrics['piece'].items():
+        if isinstance(value, tuple):
+            assert chunked_metrics[metric] == pytest.approx(value)
+        else:
+            assert np.allclose(chunked_metrics[metric], value, equal_nan=True)
+
+    with pytest.raises(MemoryLimitError):
+        get_chunked_metrics(midi_file_path, max_memory=1000)
+    with open(midi_file_path, 'rb') as midi_file:
+        with pytest.raises(MemoryLimitError):
+            get_chunked_metrics(midi_file.read(), max_memory=1000)
+
+
+def test_chunked_metrics_memory_limit(tmp_path):
+    midi = pretty_midi.PrettyMIDI()
+    for program in range(2):
+        instrument = pretty_midi.Instrument(program=program)
+        for i in range(10000):
+            start = i * 0.1 + program * 0.01
+            instrument.notes.append(pretty_midi.Note(velocity=90, pitch=40 + (i * 7 + program) % 50, start=start,
+                                                     end=start + 0.5 + i % 4))
+        midi.instruments.append(instrument)
+    midi_path = str(tmp_path / 'large.mid')
+    midi.write(midi_path)
+
+    # The smallest of increasing limits which the piece is accepted with must bound the memory used
+    max_memory = 2 ** 20
+    while True:
+        try:
+            get_chunked_metrics(midi_path, max_memory=max_memory, chunk_seconds=30.0)
+            break
+        except MemoryLimitError:
+            max_memory = int(max_memory * 1.25)
+    tracemalloc.start()
+    get_chunked_metrics(midi_path, max_memory=max_memory, chunk_seconds=30.0)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    assert peak <= max_memory